@@ -0,0 +1,362 @@
+import asyncio
+import argparse
+import json
+import math
+import socket
+import stat
+import struct
+import os
+import numpy as np
+from audio_engine import AudioEngine
+
+# Wire format (server -> client): every message is a frame of
+#   kind (1 byte) | payload length (uint32, big-endian) | payload
+# kind b'J' carries a UTF-8 JSON reply, kind b'L' carries a level frame:
+#   current_frame (uint64) | channel count (uint16) | levels (float32 * count), little-endian
+# Clients send one JSON command per line, e.g. {"cmd": "seek", "position": 0.5}
+
+FRAME_HEADER = struct.Struct(">cI")
+LEVEL_HEADER = struct.Struct("<QH")
+
+KIND_REPLY = b"J"
+KIND_LEVELS = b"L"
+
+MAX_LEVEL_RATE = 120.0
+# Kept small so a slow client can't have seconds of old level frames queued in the kernel,
+# which rounds this up to its own minimum
+SEND_BUFFER = 1024
+
+# Same ranges as the UI sliders
+MAX_VOLUME = 1.0
+MAX_GAIN = 1.5
+
+# Commands that touch playback or the mixing matrix, which load_file swaps out mid-way
+LOAD_GUARDED_COMMANDS = {"load", "play", "pause", "stop", "seek", "gain", "route", "scene"}
+
+
+def pack_frame(kind, payload):
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+def pack_levels(current_frame, levels):
+    levels = np.asarray(levels, dtype="<f4")
+    return pack_frame(KIND_LEVELS, LEVEL_HEADER.pack(current_frame, len(levels)) + levels.tobytes())
+
+
+def clamp_finite(value, low, high):
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"Value must be finite, got {value}")
+    return min(max(value, low), high)
+
+
+def check_index(value, count, name):
+    index = int(value)
+    if not 0 <= index < count:
+        raise ValueError(f"{name} {index} out of range (0-{count - 1})")
+    return index
+
+
+class ControlClient:
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.level_rate = None
+        self.sender_task = None
+        # Only the newest level frame is ever waiting to be sent
+        self.latest_levels = None
+        self.levels_ready = asyncio.Event()
+        self.frames_sent = 0
+        self.frames_dropped = 0
+
+        # drain() then waits until everything has reached the kernel, which holds at most SEND_BUFFER
+        writer.transport.set_write_buffer_limits(high=0)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+
+    def send_reply(self, reply):
+        if not self.writer.is_closing():
+            self.writer.write(pack_frame(KIND_REPLY, json.dumps(reply).encode("utf-8")))
+
+    def subscribe(self, rate):
+        self.unsubscribe()
+        self.level_rate = rate
+        self.server.add_level_subscriber(self, rate)
+        self.sender_task = asyncio.create_task(self.send_levels())
+
+    def unsubscribe(self):
+        if self.level_rate is not None:
+            self.server.remove_level_subscriber(self, self.level_rate)
+            self.level_rate = None
+        if self.sender_task:
+            self.sender_task.cancel()
+            self.sender_task = None
+        self.latest_levels = None
+        self.levels_ready.clear()
+
+    def offer_levels(self, frame):
+        # Called by the server's ticker; an unsent older frame is replaced, never queued
+        if self.latest_levels is not None:
+            self.frames_dropped += 1
+        self.latest_levels = frame
+        self.levels_ready.set()
+
+    async def send_levels(self):
+        try:
+            while not self.writer.is_closing():
+                await self.levels_ready.wait()
+                self.levels_ready.clear()
+                frame = self.latest_levels
+                self.latest_levels = None
+                if frame is None:
+                    continue
+                self.writer.write(frame)
+                self.frames_sent += 1
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+
+    async def run(self):
+        try:
+            while True:
+                try:
+                    line = await self.reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    self.send_reply({"ok": False, "error": "Command line too long"})
+                    break
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+
+                try:
+                    request = json.loads(line)
+                    reply = await self.server.handle_command(self, request)
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+
+                self.send_reply(reply)
+                await self.writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.unsubscribe()
+            self.writer.close()
+
+
+class ControlServer:
+    def __init__(self, engine, host="127.0.0.1", port=8765, unix_path=None):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.server = None
+        self.clients = set()
+        self.load_lock = asyncio.Lock()
+        # One ticker per distinct rate, shared by every client subscribed at it
+        self.level_subscribers = {}
+        self.level_tickers = {}
+
+        self.commands = {
+            "status": self.cmd_status,
+            "load": self.cmd_load,
+            "play": self.cmd_play,
+            "pause": self.cmd_pause,
+            "stop": self.cmd_stop,
+            "seek": self.cmd_seek,
+            "volume": self.cmd_volume,
+            "gain": self.cmd_gain,
+            "route": self.cmd_route,
+            "mute": self.cmd_mute,
+            "solo": self.cmd_solo,
+            "scene": self.cmd_scene,
+            "subscribe": self.cmd_subscribe,
+            "unsubscribe": self.cmd_unsubscribe,
+        }
+
+    async def start(self):
+        if self.unix_path:
+            if os.path.exists(self.unix_path):
+                # Only clear out a stale socket, never some other file at a mistyped path
+                if not stat.S_ISSOCK(os.stat(self.unix_path).st_mode):
+                    raise FileExistsError(f"{self.unix_path} exists and is not a socket")
+                os.remove(self.unix_path)
+            self.server = await asyncio.start_unix_server(self.on_connect, path=self.unix_path)
+            print(f"Control server listening on {self.unix_path}")
+        else:
+            self.server = await asyncio.start_server(self.on_connect, self.host, self.port)
+            print(f"Control server listening on {self.host}:{self.port}")
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            if self.unix_path and os.path.exists(self.unix_path) and stat.S_ISSOCK(os.stat(self.unix_path).st_mode):
+                os.remove(self.unix_path)
+
+    async def on_connect(self, reader, writer):
+        client = ControlClient(self, reader, writer)
+        self.clients.add(client)
+        try:
+            await client.run()
+        finally:
+            self.clients.discard(client)
+
+    def add_level_subscriber(self, client, rate):
+        self.level_subscribers.setdefault(rate, set()).add(client)
+        if rate not in self.level_tickers:
+            self.level_tickers[rate] = asyncio.create_task(self.sample_levels(rate))
+
+    def remove_level_subscriber(self, client, rate):
+        subscribers = self.level_subscribers.get(rate)
+        if subscribers is None:
+            return
+        subscribers.discard(client)
+        if not subscribers:
+            del self.level_subscribers[rate]
+            self.level_tickers.pop(rate).cancel()
+
+    async def sample_levels(self, rate):
+        # Only reads the engine's latest snapshot, never waits on the audio callback
+        interval = 1.0 / rate
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            # Packed once per tick, the same bytes go to every subscriber
+            frame = pack_levels(self.engine.current_frame, self.engine.current_levels)
+            for client in list(self.level_subscribers.get(rate, ())):
+                client.offer_levels(frame)
+
+            next_tick += interval
+            delay = next_tick - loop.time()
+            if delay < 0:
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def handle_command(self, client, request):
+        name = request.get("cmd")
+        handler = self.commands.get(name)
+        if handler is None:
+            return {"ok": False, "error": f"Unknown command: {name}"}
+        if name in LOAD_GUARDED_COMMANDS and self.load_lock.locked():
+            return {"ok": False, "error": "loading"}
+        result = await handler(client, request)
+        reply = {"ok": True, "cmd": name}
+        if result:
+            reply.update(result)
+        return reply
+
+    async def cmd_status(self, client, request):
+        engine = self.engine
+        duration = len(engine.data) / engine.samplerate if engine.data is not None else 0.0
+        position = engine.current_frame / len(engine.data) if engine.data is not None and len(engine.data) else 0.0
+        return {
+            "filename": engine.filename,
+            "is_playing": engine.is_playing,
+            "samplerate": engine.samplerate,
+            "input_channels": engine.input_channels,
+            "output_channels": engine.output_channels,
+            "virtual_channels": engine.virtual_channels,
+            "duration": duration,
+            "position": position,
+            "volume": engine.volume,
+            "scene": engine.scene_mode,
+            "mute": np.flatnonzero(engine.mute_flags).tolist(),
+            "solo": np.flatnonzero(engine.solo_flags).tolist(),
+            "clients": len(self.clients),
+        }
+
+    async def cmd_load(self, client, request):
+        # Decoding can take seconds, keep serving other clients meanwhile
+        async with self.load_lock:
+            success, msg = await asyncio.to_thread(self.engine.load_file, request["path"])
+        if not success:
+            raise Exception(msg)
+        return {"message": msg}
+
+    async def cmd_play(self, client, request):
+        self.engine.play()
+
+    async def cmd_pause(self, client, request):
+        self.engine.pause()
+
+    async def cmd_stop(self, client, request):
+        self.engine.stop()
+
+    async def cmd_seek(self, client, request):
+        self.engine.seek(clamp_finite(request["position"], 0.0, 1.0))
+
+    async def cmd_volume(self, client, request):
+        self.engine.volume = clamp_finite(request["value"], 0.0, MAX_VOLUME)
+
+    def require_loaded(self):
+        # The engine silently ignores gain changes without a mixing matrix
+        if self.engine.mixing_matrix is None or self.engine.input_channels == 0:
+            raise ValueError("No file loaded")
+
+    async def cmd_gain(self, client, request):
+        self.require_loaded()
+        input_idx = check_index(request["input"], self.engine.input_channels, "Input")
+        output_idx = check_index(request["output"], self.engine.virtual_channels, "Output")
+        gain = clamp_finite(request["gain"], 0.0, MAX_GAIN)
+        self.engine.set_channel_gain(input_idx, output_idx, gain)
+
+    async def cmd_route(self, client, request):
+        # Same as picking a source in the speaker dropdown: one input feeds the output, or none
+        self.require_loaded()
+        output_idx = check_index(request["output"], self.engine.virtual_channels, "Output")
+        input_idx = request.get("input")
+        if input_idx is not None:
+            input_idx = check_index(input_idx, self.engine.input_channels, "Input")
+        gain = clamp_finite(request.get("gain", 1.0), 0.0, MAX_GAIN)
+        for i in range(self.engine.input_channels):
+            self.engine.set_channel_gain(i, output_idx, 0.0)
+        if input_idx is not None:
+            self.engine.set_channel_gain(input_idx, output_idx, gain)
+
+    async def cmd_mute(self, client, request):
+        channel_idx = check_index(request["channel"], self.engine.virtual_channels, "Channel")
+        self.engine.set_mute(channel_idx, bool(request["state"]))
+
+    async def cmd_solo(self, client, request):
+        channel_idx = check_index(request["channel"], self.engine.virtual_channels, "Channel")
+        self.engine.set_solo(channel_idx, bool(request["state"]))
+
+    async def cmd_scene(self, client, request):
+        self.engine.set_scene(request["name"])
+
+    async def cmd_subscribe(self, client, request):
+        rate = float(request.get("rate", 30.0))
+        if not (math.isfinite(rate) and 0 < rate <= MAX_LEVEL_RATE):
+            raise ValueError(f"Rate must be in (0, {MAX_LEVEL_RATE}] Hz")
+        client.subscribe(rate)
+        return {"rate": rate, "channels": self.engine.virtual_channels}
+
+    async def cmd_unsubscribe(self, client, request):
+        client.unsubscribe()
+        return {"frames_sent": client.frames_sent, "frames_dropped": client.frames_dropped}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless pySpatialAudio control server")
+    parser.add_argument("file", nargs="?", help="Audio file to load on startup")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", dest="unix_path", help="Listen on a Unix socket instead of TCP")
+    args = parser.parse_args()
+
+    engine = AudioEngine()
+    if args.file:
+        engine.load_file(args.file)
+
+    server = ControlServer(engine, host=args.host, port=args.port, unix_path=args.unix_path)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        engine.stop()
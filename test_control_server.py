@@ -0,0 +1,275 @@
+import asyncio
+import json
+import socket
+import sys
+import threading
+import types
+import numpy as np
+import pytest
+
+# The server never touches the audio device, so run without PortAudio
+try:
+    import sounddevice
+except (ImportError, OSError):
+    sys.modules["sounddevice"] = types.ModuleType("sounddevice")
+
+import control_server as cs
+
+
+class FakeEngine:
+    def __init__(self):
+        self.filename = None
+        self.data = np.zeros((48000, 2))
+        self.samplerate = 48000
+        self.input_channels = 2
+        self.output_channels = 2
+        self.virtual_channels = 24
+        self.current_frame = 0
+        self.is_playing = False
+        self.volume = 1.0
+        self.scene_mode = "Standard"
+        self.current_levels = np.arange(24) / 24
+        self.mixing_matrix = np.zeros((2, 24))
+        self.mute_flags = np.zeros(24, dtype=bool)
+        self.solo_flags = np.zeros(24, dtype=bool)
+
+    def set_channel_gain(self, input_idx, output_idx, gain):
+        self.mixing_matrix[input_idx][output_idx] = gain
+
+    def set_mute(self, channel_idx, state):
+        self.mute_flags[channel_idx] = state
+
+    def set_solo(self, channel_idx, state):
+        self.solo_flags[channel_idx] = state
+
+
+async def read_frame(reader):
+    kind, length = cs.FRAME_HEADER.unpack(await reader.readexactly(cs.FRAME_HEADER.size))
+    return kind, await reader.readexactly(length)
+
+
+async def read_reply(reader):
+    while True:
+        kind, payload = await read_frame(reader)
+        if kind == cs.KIND_REPLY:
+            return json.loads(payload)
+
+
+def unpack_levels(payload):
+    current_frame, count = cs.LEVEL_HEADER.unpack_from(payload)
+    levels = np.frombuffer(payload, dtype="<f4", offset=cs.LEVEL_HEADER.size, count=count)
+    return current_frame, levels
+
+
+async def send(writer, request):
+    writer.write((json.dumps(request) + "\n").encode("utf-8"))
+    await writer.drain()
+
+
+def run_with_server(test, engine=None):
+    async def main():
+        server = cs.ControlServer(engine or FakeEngine(), port=0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            await test(server, port)
+        finally:
+            server.server.close()
+            await server.server.wait_closed()
+
+    asyncio.run(main())
+
+
+def test_pack_levels_layout():
+    frame = cs.pack_levels(1234, [0.5, 0.25])
+    kind, length = cs.FRAME_HEADER.unpack_from(frame)
+    assert kind == cs.KIND_LEVELS
+    assert length == len(frame) - cs.FRAME_HEADER.size == cs.LEVEL_HEADER.size + 8
+    current_frame, levels = unpack_levels(frame[cs.FRAME_HEADER.size:])
+    assert current_frame == 1234
+    assert levels.tolist() == [0.5, 0.25]
+
+
+def test_subscribe_streams_level_frames():
+    async def test(server, port):
+        server.engine.current_frame = 4800
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        await send(writer, {"cmd": "subscribe", "rate": 100})
+        reply = await read_reply(reader)
+        assert reply == {"ok": True, "cmd": "subscribe", "rate": 100.0, "channels": 24}
+
+        kind, payload = await read_frame(reader)
+        assert kind == cs.KIND_LEVELS
+        current_frame, levels = unpack_levels(payload)
+        assert current_frame == 4800
+        np.testing.assert_allclose(levels, server.engine.current_levels, rtol=1e-6)
+        writer.close()
+
+    run_with_server(test)
+
+
+def test_subscribers_share_one_ticker_per_rate(monkeypatch):
+    packed = []
+    pack_levels = cs.pack_levels
+    monkeypatch.setattr(cs, "pack_levels", lambda *args: packed.append(args) or pack_levels(*args))
+
+    async def test(server, port):
+        clients = [await asyncio.open_connection("127.0.0.1", port) for _ in range(3)]
+        for reader, writer in clients:
+            await send(writer, {"cmd": "subscribe", "rate": 50})
+            await read_reply(reader)
+        assert list(server.level_tickers) == [50.0]
+
+        frames = [await read_frame(reader) for reader, writer in clients]
+        assert all(kind == cs.KIND_LEVELS for kind, payload in frames)
+        await asyncio.sleep(0.2)
+        # About 10 ticks at 50 Hz, not 30 packs for 3 clients
+        assert len(packed) < 15
+
+        for reader, writer in clients:
+            await send(writer, {"cmd": "unsubscribe"})
+            await read_reply(reader)
+            writer.close()
+        assert server.level_tickers == {}
+        assert server.level_subscribers == {}
+
+    run_with_server(test)
+
+
+def test_unknown_command_and_bad_values():
+    async def test(server, port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        await send(writer, {"cmd": "bogus"})
+        assert await read_reply(reader) == {"ok": False, "error": "Unknown command: bogus"}
+
+        writer.write(b'{"cmd": "volume", "value": NaN}\n')
+        assert (await read_reply(reader))["ok"] is False
+        assert server.engine.volume == 1.0
+
+        await send(writer, {"cmd": "gain", "input": 0, "output": 3, "gain": 50})
+        assert (await read_reply(reader))["ok"] is True
+        assert server.engine.mixing_matrix[0][3] == cs.MAX_GAIN
+
+        for request in [
+            {"cmd": "gain", "input": 2, "output": 0, "gain": 1.0},
+            {"cmd": "gain", "input": 0, "output": 24, "gain": 1.0},
+            {"cmd": "route", "input": -1, "output": 0},
+            {"cmd": "route", "input": 0, "output": 99},
+            {"cmd": "mute", "channel": 24, "state": True},
+            {"cmd": "solo", "channel": -1, "state": True},
+        ]:
+            await send(writer, request)
+            reply = await read_reply(reader)
+            assert reply["ok"] is False
+            assert "out of range" in reply["error"]
+        assert not server.engine.mute_flags.any()
+        assert not server.engine.solo_flags.any()
+
+        server.engine.mixing_matrix = None
+        server.engine.input_channels = 0
+        await send(writer, {"cmd": "route", "output": 0})
+        assert await read_reply(reader) == {"ok": False, "error": "No file loaded"}
+        writer.close()
+
+    run_with_server(test)
+
+
+def test_commands_rejected_while_loading():
+    engine = FakeEngine()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def load_file(filename):
+        started.set()
+        release.wait(5)
+        return True, "Success"
+
+    engine.load_file = load_file
+    engine.play = lambda: calls.append("play")
+
+    async def test(server, port):
+        reader_a, writer_a = await asyncio.open_connection("127.0.0.1", port)
+        reader_b, writer_b = await asyncio.open_connection("127.0.0.1", port)
+        await send(writer_a, {"cmd": "load", "path": "song.flac"})
+        await asyncio.to_thread(started.wait, 5)
+
+        await send(writer_b, {"cmd": "play"})
+        assert await read_reply(reader_b) == {"ok": False, "error": "loading"}
+        await send(writer_b, {"cmd": "gain", "input": 0, "output": 0, "gain": 1.0})
+        assert await read_reply(reader_b) == {"ok": False, "error": "loading"}
+        await send(writer_b, {"cmd": "status"})
+        assert (await read_reply(reader_b))["ok"] is True
+        assert calls == []
+
+        release.set()
+        assert (await read_reply(reader_a))["ok"] is True
+        await send(writer_b, {"cmd": "play"})
+        assert (await read_reply(reader_b))["ok"] is True
+        assert calls == ["play"]
+        writer_a.close()
+        writer_b.close()
+
+    run_with_server(test, engine)
+
+
+def test_overlong_command_closes_connection():
+    async def test(server, port):
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"x" * (128 * 1024))
+        await writer.drain()
+        # The error reply may be lost to a reset since the rest of the line is never read
+        try:
+            while await reader.read(65536):
+                pass
+        except ConnectionResetError:
+            pass
+        await asyncio.sleep(0.05)
+        assert not server.clients
+        assert errors == []
+        writer.close()
+
+    run_with_server(test)
+
+
+def test_slow_client_gets_newest_levels():
+    async def test(server, port):
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+        sock.connect(("127.0.0.1", port))
+        reader, writer = await asyncio.open_connection(sock=sock)
+
+        await send(writer, {"cmd": "subscribe", "rate": 120})
+        await read_reply(reader)
+        # Stop reading while "playback" keeps moving
+        writer.transport.pause_reading()
+        for frame in range(1, 241):
+            server.engine.current_frame = frame
+            await asyncio.sleep(1 / 120)
+
+        client = next(iter(server.clients))
+        assert client.frames_dropped > 0
+        writer.transport.resume_reading()
+
+        # What was stuck in the socket buffers is bounded, then the newest snapshot arrives
+        stale = 0
+        while True:
+            kind, payload = await asyncio.wait_for(read_frame(reader), 1.0)
+            if kind == cs.KIND_LEVELS and unpack_levels(payload)[0] == 240:
+                break
+            stale += 1
+        assert stale < 120
+        writer.close()
+
+    run_with_server(test)
+
+
+def test_unix_socket_refuses_to_remove_regular_file(tmp_path):
+    path = tmp_path / "not_a_socket"
+    path.write_text("keep me")
+    server = cs.ControlServer(FakeEngine(), unix_path=str(path))
+    with pytest.raises(FileExistsError):
+        asyncio.run(server.start())
+    assert path.read_text() == "keep me"